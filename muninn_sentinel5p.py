@@ -6,6 +6,11 @@ from muninn.struct import Struct
 from muninn.schema import Mapping, Text, Integer
 from muninn.geometry import Point, LinearRing, Polygon
 
+try:
+    import coda
+except ImportError:
+    coda = None
+
 
 # Namespaces
 
@@ -107,18 +112,92 @@ AUX_PRODUCT_TYPES = [
     'REF_XS__CO',
 ]
 
-MUNINN_PRODUCT_TYPES = L1_PRODUCT_TYPES + L2_PRODUCT_TYPES + AUX_PRODUCT_TYPES
+MUNINN_PRODUCT_TYPES = tuple(L1_PRODUCT_TYPES + L2_PRODUCT_TYPES + AUX_PRODUCT_TYPES)
+
+# sets for fast product type lookups in product_type_plugin()
+_L1L2_PRODUCT_TYPE_SET = frozenset(L1_PRODUCT_TYPES + L2_PRODUCT_TYPES)
+_AUX_PRODUCT_TYPE_SET = frozenset(AUX_PRODUCT_TYPES)
+
+
+def _basename(path):
+    # equivalent to os.path.basename(), but without the module indirection
+    i = path.rfind(os.sep)
+    if os.altsep:
+        i = max(i, path.rfind(os.altsep))
+    return path[i + 1:]
+
+
+def _stem(filename):
+    # strip the extension from a filename (as returned by _basename())
+    i = filename.rfind('.')
+    return filename[:i] if i > 0 else filename
+
+
+def _parse_ts(s):
+    # equivalent to datetime.strptime(s, "%Y%m%dT%H%M%S") for the 15 character [\dT] strings matched by the filename
+    # regex, but much faster
+    if s[8] != 'T':
+        raise ValueError("time data %r does not match format '%%Y%%m%%dT%%H%%M%%S'" % s)
+    return datetime(int(s[0:4]), int(s[4:6]), int(s[6:8]), int(s[9:11]), int(s[11:13]), int(s[13:15]))
+
+
+def _parse_date(s):
+    # equivalent to datetime.strptime(s, "%Y%m%d") for the 8 digit strings matched by the filename regex, but much
+    # faster
+    return datetime(int(s[0:4]), int(s[4:6]), int(s[6:8]))
+
+
+# known file classes; used to share a single string object per file class between all analyzed products
+_FILE_CLASSES = {file_class: file_class for file_class in ['NRTI', 'OFFL', 'RPRO', 'TEST', 'OGCA', 'GSOV', 'OPER']}
+
+# (start, stop) offsets of the file type, which is at the same position in all L1/L2 and auxiliary filenames
+_FILE_TYPE_START, _FILE_TYPE_STOP = 9, 19
+
+# (start, stop) offsets of the fields in fixed-width L1/L2 and auxiliary filenames
+_FILENAME_FIELD_OFFSETS = {
+    'file_class': (4, 8),
+    'file_type': (_FILE_TYPE_START, _FILE_TYPE_STOP),
+    'validity_start': (20, 35),
+    'validity_stop': (36, 51),
+    'orbit': (52, 57),
+    'collection': (58, 60),
+    'processor_version': (61, 67),
+    'creation_date': (68, 83),
+}
+
+_AUX_FILENAME_FIELD_OFFSETS = {
+    'file_class': (4, 8),
+    'file_type': (_FILE_TYPE_START, _FILE_TYPE_STOP),
+    'validity_start': (20, 35),
+    'validity_stop': (36, 51),
+    'creation_date': (52, 67),
+}
+
+_FILENAME_REGEX_FLAGS = getattr(re, 'ASCII', 0)  # Python 2 str patterns are always ASCII
+
+_filename_regex_cache = {}
+
+
+def _filename_regex(pattern):
+    # The file type is matched generically, so all product types with the same filename structure share a single
+    # compiled regex; the product type plugins check the matched file type themselves.
+    regex = _filename_regex_cache.get(pattern)
+    if regex is None:
+        # filenames are ASCII by specification, so there is no need for unicode matching of e.g. \d
+        regex = _filename_regex_cache[pattern] = re.compile(pattern, _FILENAME_REGEX_FLAGS)
+    return regex
+
+
+_FOOTPRINT_PATH = \
+    "/METADATA/EOP_METADATA/om_featureOfInterest/eop_multiExtentOf/gml_surfaceMembers/gml_exterior@gml_posList"
 
 
 def get_footprint(product):
-    try:
-        import coda
-    except ImportError:
+    if coda is None:
         return None
-    path = "/METADATA/EOP_METADATA/om_featureOfInterest/eop_multiExtentOf/gml_surfaceMembers/gml_exterior@gml_posList"
     pf = coda.open(product)
     try:
-        coord = coda.fetch(pf, path).split(' ')
+        coord = coda.fetch(pf, _FOOTPRINT_PATH).split(' ')
     except coda.CodacError:
         return None
     finally:
@@ -136,7 +215,7 @@ class Sentinel5PProduct(object):
         pattern = [
             r"S5P",
             r"(?P<file_class>.{4})",
-            r"(?P<file_type>%s)" % product_type,
+            r"(?P<file_type>.{10})",
             r"(?P<validity_start>[\dT]{15})",
             r"(?P<validity_stop>[\dT]{15})",
             r"(?P<orbit>.{5})",
@@ -144,7 +223,13 @@ class Sentinel5PProduct(object):
             r"(?P<processor_version>.{6})",
             r"(?P<creation_date>[\dT]{15})"
         ]
-        self.filename_pattern = "_".join(pattern) + r"\.nc$"
+        self.filename_pattern = "_".join(pattern) + r"\.nc\Z"
+        self._filename_re = _filename_regex(self.filename_pattern)
+        # literal filename prefix and fixed filename length; allow cheap rejection of non-matching filenames
+        self._prefix = "S5P_"
+        self._filename_length = len(
+            "S5P_CCCC_TTTTTTTTTT_yyyymmddTHHMMSS_yyyymmddTHHMMSS_ooooo_cc_pppppp_yyyymmddTHHMMSS.nc")
+        self._field_offsets = _FILENAME_FIELD_OFFSETS
 
     @property
     def namespaces(self):
@@ -163,8 +248,15 @@ class Sentinel5PProduct(object):
     def hash_type(self):
         return "md5"
 
+    def _match(self, filename):
+        # the filename layout is fixed-width, so check the length, prefix, and file type before running the regex
+        if len(filename) != self._filename_length or not filename.startswith(self._prefix) or \
+                filename[_FILE_TYPE_START:_FILE_TYPE_STOP] != self.product_type:
+            return None
+        return self._filename_re.match(filename)
+
     def parse_filename(self, filename):
-        match = re.match(self.filename_pattern, os.path.basename(filename))
+        match = self._match(_basename(filename))
         if match:
             return match.groupdict()
         return None
@@ -172,37 +264,52 @@ class Sentinel5PProduct(object):
     def identify(self, paths):
         if len(paths) != 1:
             return False
-        return re.match(self.filename_pattern, os.path.basename(paths[0])) is not None
+        return self._match(_basename(paths[0])) is not None
+
+    def _parse_filename_fields(self, filename):
+        # same result as parse_filename(), but once the filename has been validated the fields are extracted at their
+        # fixed offsets, which is cheaper than building the groupdict() of the match
+        filename = _basename(filename)
+        if self._match(filename) is None:
+            return None
+        return {key: filename[start:stop] for key, (start, stop) in self._field_offsets.items()}
 
     def archive_path(self, properties):
-        name_attrs = self.parse_filename(properties.core.physical_name)
+        if 's5p' in properties:
+            # reuse the filename attributes that analyze() already stored in the s5p namespace
+            file_type = properties.s5p.file_type
+            file_class = properties.s5p.file_class
+        else:
+            name_attrs = self.parse_filename(properties.core.physical_name)
+            file_type = name_attrs['file_type']
+            file_class = name_attrs['file_class']
         validity_start = properties.core.validity_start
         return os.path.join(
             "sentinel-5p",
-            name_attrs['file_type'],
-            name_attrs['file_class'],
-            validity_start.strftime("%Y"),
-            validity_start.strftime("%m"),
-            validity_start.strftime("%d")
+            file_type,
+            file_class,
+            "%04d" % validity_start.year,
+            "%02d" % validity_start.month,
+            "%02d" % validity_start.day
         )
 
     def analyze(self, paths, filename_only=False):
         inpath = paths[0]
-        name_attrs = self.parse_filename(inpath)
+        name_attrs = self._parse_filename_fields(inpath)
 
         properties = Struct()
 
         core = properties.core = Struct()
-        core.product_name = os.path.splitext(os.path.basename(inpath))[0]
-        core.creation_date = datetime.strptime(name_attrs['creation_date'], "%Y%m%dT%H%M%S")
-        core.validity_start = datetime.strptime(name_attrs['validity_start'], "%Y%m%dT%H%M%S")
-        core.validity_stop = datetime.strptime(name_attrs['validity_stop'], "%Y%m%dT%H%M%S")
+        core.product_name = _stem(_basename(inpath))
+        core.creation_date = _parse_ts(name_attrs['creation_date'])
+        core.validity_start = _parse_ts(name_attrs['validity_start'])
+        core.validity_stop = _parse_ts(name_attrs['validity_stop'])
         if not filename_only:
             core.footprint = get_footprint(inpath)
 
         s5p = properties.s5p = Struct()
-        s5p.file_class = name_attrs['file_class']
-        s5p.file_type = name_attrs['file_type']
+        s5p.file_class = _FILE_CLASSES.get(name_attrs['file_class'], name_attrs['file_class'])
+        s5p.file_type = self.product_type  # _match() guarantees this equals name_attrs['file_type']
         s5p.orbit = int(name_attrs['orbit'])
         s5p.collection = int(name_attrs['collection'])
         s5p.processor_version = int(name_attrs['processor_version'])
@@ -217,15 +324,20 @@ class Sentinel5PAuxiliaryProduct(Sentinel5PProduct):
         pattern = [
             r"S5P",
             r"(?P<file_class>.{4})",
-            r"(?P<file_type>%s)" % product_type,
+            r"(?P<file_type>.{10})",
             r"(?P<validity_start>[\dT]{15})",
             r"(?P<validity_stop>[\dT]{15})",
             r"(?P<creation_date>[\dT]{15})"
         ]
         if extension:
-            self.filename_pattern = "_".join(pattern) + r"\." + extension + "$"
+            self.filename_pattern = "_".join(pattern) + r"\." + extension + r"\Z"
         else:
-            self.filename_pattern = "_".join(pattern) + "$"
+            self.filename_pattern = "_".join(pattern) + r"\Z"
+        self._filename_re = _filename_regex(self.filename_pattern)
+        self._filename_length = len("S5P_CCCC_TTTTTTTTTT_yyyymmddTHHMMSS_yyyymmddTHHMMSS_yyyymmddTHHMMSS")
+        if extension:
+            self._filename_length += len(extension) + 1
+        self._field_offsets = _AUX_FILENAME_FIELD_OFFSETS
 
     def archive_path(self, properties):
         validity_start = properties.core.validity_start
@@ -234,31 +346,31 @@ class Sentinel5PAuxiliaryProduct(Sentinel5PProduct):
         return os.path.join(
             "sentinel-5p",
             self.product_type,
-            validity_start.strftime("%Y"),
-            validity_start.strftime("%m")
+            "%04d" % validity_start.year,
+            "%02d" % validity_start.month
         )
 
     def analyze(self, paths, filename_only=False):
         inpath = paths[0]
-        name_attrs = self.parse_filename(inpath)
+        name_attrs = self._parse_filename_fields(inpath)
 
         properties = Struct()
 
         core = properties.core = Struct()
-        core.product_name = os.path.splitext(os.path.basename(inpath))[0]
-        core.creation_date = datetime.strptime(name_attrs['creation_date'], "%Y%m%dT%H%M%S")
+        core.product_name = _stem(_basename(inpath))
+        core.creation_date = _parse_ts(name_attrs['creation_date'])
         if name_attrs['validity_start'] == "00000000T000000":
             core.validity_start = datetime.min
         else:
-            core.validity_start = datetime.strptime(name_attrs['validity_start'], "%Y%m%dT%H%M%S")
+            core.validity_start = _parse_ts(name_attrs['validity_start'])
         if name_attrs['validity_stop'] == "99999999T999999":
             core.validity_stop = datetime.max
         else:
-            core.validity_stop = datetime.strptime(name_attrs['validity_stop'], "%Y%m%dT%H%M%S")
+            core.validity_stop = _parse_ts(name_attrs['validity_stop'])
 
         s5p = properties.s5p = Struct()
-        s5p.file_class = name_attrs['file_class']
-        s5p.file_type = name_attrs['file_type']
+        s5p.file_class = _FILE_CLASSES.get(name_attrs['file_class'], name_attrs['file_class'])
+        s5p.file_type = self.product_type  # _match() guarantees this equals name_attrs['file_type']
 
         return properties
 
@@ -272,7 +384,18 @@ class Sentinel5PAuxiliaryNISEProduct(Sentinel5PAuxiliaryProduct):
             r"SSMISF18",
             r"(?P<validity_start>[\d]{8})",
         ]
-        self.filename_pattern = "_".join(pattern) + r"\.HDFEOS$"
+        self.filename_pattern = "_".join(pattern) + r"\.HDFEOS\Z"
+        self._filename_re = _filename_regex(self.filename_pattern)
+        self._prefix = "NISE_SSMISF18_"
+        self._filename_length = len("NISE_SSMISF18_yyyymmdd.HDFEOS")
+        # NISE filenames do not follow the S5P layout; analyze() uses parse_filename() instead of the offset tables
+        self._field_offsets = None
+
+    def _match(self, filename):
+        # same checks as the base class, except for the file type, which is not part of NISE filenames
+        if len(filename) != self._filename_length or not filename.startswith(self._prefix):
+            return None
+        return self._filename_re.match(filename)
 
     def analyze(self, paths, filename_only=False):
         inpath = paths[0]
@@ -281,8 +404,8 @@ class Sentinel5PAuxiliaryNISEProduct(Sentinel5PAuxiliaryProduct):
         properties = Struct()
 
         core = properties.core = Struct()
-        core.product_name = os.path.splitext(os.path.basename(inpath))[0]
-        core.validity_start = datetime.strptime(name_attrs['validity_start'], "%Y%m%d")
+        core.product_name = _stem(_basename(inpath))
+        core.validity_start = _parse_date(name_attrs['validity_start'])
         core.validity_stop = core.validity_start + timedelta(days=1)
         core.creation_date = core.validity_start
 
@@ -297,14 +420,59 @@ def product_types():
     return MUNINN_PRODUCT_TYPES
 
 
+_product_type_plugin_cache = {}
+
+
 def product_type_plugin(product_type):
-    if product_type in L1_PRODUCT_TYPES + L2_PRODUCT_TYPES:
+    # plugins are not modified after construction, so a single instance per product type can be shared
+    plugin = _product_type_plugin_cache.get(product_type)
+    if plugin is None:
+        plugin = _create_product_type_plugin(product_type)
+        if plugin is not None:
+            _product_type_plugin_cache[product_type] = plugin
+    return plugin
+
+
+def _create_product_type_plugin(product_type):
+    if product_type in _L1L2_PRODUCT_TYPE_SET:
         return Sentinel5PProduct(product_type)
     if product_type == "AUX_NISE__":
         return Sentinel5PAuxiliaryNISEProduct(product_type)
-    if product_type in AUX_PRODUCT_TYPES:
+    if product_type in _AUX_PRODUCT_TYPE_SET:
         if product_type.startswith("CFG"):
             return Sentinel5PAuxiliaryProduct(product_type, "cfg")
         if product_type == "LUT_CH4RFC":
             return Sentinel5PAuxiliaryProduct(product_type, "zip")
         return Sentinel5PAuxiliaryProduct(product_type)
+
+
+def identify_product_type(paths):
+    # Return the product type of the product at the given paths, or None if it is not a supported Sentinel-5P
+    # product. This gives the same result as calling identify() on the plugin of every product type, but since the
+    # file type is at a fixed position in the filename, only the plugin of a single candidate product type is tried.
+    if len(paths) != 1:
+        return None
+    filename = _basename(paths[0])
+    if filename.startswith("NISE_"):
+        product_type = "AUX_NISE__"
+    else:
+        product_type = filename[_FILE_TYPE_START:_FILE_TYPE_STOP]
+    if product_type not in _L1L2_PRODUCT_TYPE_SET and product_type not in _AUX_PRODUCT_TYPE_SET:
+        return None
+    if product_type_plugin(product_type).identify(paths):
+        return product_type
+    return None
+
+
+def _analyze_path(plugin, filename_only, path):
+    return plugin.analyze([path], filename_only=filename_only)
+
+
+def analyze_many(plugin, paths, workers=None, filename_only=False):
+    # Analyze multiple single-file products of the given product type plugin in parallel and return the properties in
+    # the same order as paths. The CODA library used for footprint extraction is not thread-safe, so the products are
+    # analyzed in separate worker processes, each with its own CODA state.
+    from concurrent.futures import ProcessPoolExecutor
+    from functools import partial
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(partial(_analyze_path, plugin, filename_only), paths))